@@ -1,15 +1,48 @@
+import io
 import os
-import json
 import time
+import asyncio
 import threading
-import re
+import orjson
 import requests
+from collections import deque
 from datetime import datetime
 
-# --- matplotlib backend fix for Railway (headless) ---
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
+from PIL import Image, ImageDraw, ImageFont
+
+# Set USE_MATPLOTLIB=1 to fall back to the old matplotlib renderer
+USE_MATPLOTLIB = os.getenv("USE_MATPLOTLIB") == "1"
+
+# Lazily-initialized matplotlib state (figure, axes, line); importing
+# matplotlib costs tens of MB and hundreds of ms, so it's deferred until
+# the first fallback render. All drawing happens under PLOT_LOCK since
+# matplotlib isn't thread-safe.
+_MPL = None
+PLOT_LOCK = threading.Lock()
+
+def _init_mpl():
+    global _MPL
+    if _MPL is None:
+        # --- matplotlib backend fix for Railway (headless) ---
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.dates as mdates
+        import matplotlib.pyplot as plt
+
+        # Reused figure/axes: creating a Figure per /graph is the expensive part
+        fig, ax = plt.subplots(figsize=(8, 4))
+        line, = ax.plot([], [], marker='o')
+        ax.set_title("Polymarket Price - Last 6 Hours")
+        ax.set_xlabel("Time")
+        ax.set_ylabel("Price × 100")
+        ax.grid(True)
+        # Fixed layout and tick format, so each render skips tight_layout's
+        # constraint solver and autofmt_xdate's label juggling
+        fig.subplots_adjust(left=0.1, right=0.97, top=0.9, bottom=0.2)
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
+        ax.xaxis.set_major_locator(mdates.HourLocator(interval=1))
+        _MPL = (fig, ax, line)
+    return _MPL
 
 from telegram import Update, InputFile, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
@@ -17,19 +50,85 @@ from telegram.ext import Application, CommandHandler, CallbackQueryHandler, Cont
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DATA_FILE = "price_data.json"
 FETCH_INTERVAL = 600  # 10 minutes
+MAX_POINTS = 6 * 60 * 60 // FETCH_INTERVAL  # 6 hours of samples
+
+# In-memory price series; maxlen keeps only the last 6 hours
+SERIES = deque(maxlen=MAX_POINTS)
 
 if not BOT_TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN environment variable not set")
 
+# --- Shared HTTP session (keeps the TLS connection to Polymarket alive) ---
+SESSION = requests.Session()
+SESSION.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=10))
+SESSION.headers.update({
+    "User-Agent": "Mozilla/5.0 (compatible; price-bot/1.0)",
+    "Accept-Encoding": "gzip",
+})
+
+# --- Last known price cache (filled by the background poller) ---
+LAST_PRICE = None
+LAST_PRICE_TS = 0
+PRICE_LOCK = threading.Lock()
+
+def set_cached_price(price):
+    global LAST_PRICE, LAST_PRICE_TS
+    with PRICE_LOCK:
+        LAST_PRICE = price
+        LAST_PRICE_TS = time.time()
+
+# Single-flight guard: concurrent stale-cache callers share one upstream fetch
+_INFLIGHT = None
+_INFLIGHT_LOCK = asyncio.Lock()
+
+async def _refresh_price():
+    price = await asyncio.to_thread(get_price)
+    if price is not None:
+        set_cached_price(price)
+    return price
+
+async def fetch_price_coalesced():
+    global _INFLIGHT
+    async with _INFLIGHT_LOCK:
+        if _INFLIGHT is None or _INFLIGHT.done():
+            _INFLIGHT = asyncio.create_task(_refresh_price())
+        task = _INFLIGHT
+    return await task
+
+async def get_cached_price():
+    """Return the cached price, refreshing it only if older than FETCH_INTERVAL."""
+    with PRICE_LOCK:
+        price, ts = LAST_PRICE, LAST_PRICE_TS
+    if price is not None and time.time() - ts < FETCH_INTERVAL:
+        return price
+    return await fetch_price_coalesced()
+
 # --- Fetch price from Polymarket ---
+# Validators from the last successful fetch, for conditional requests
+_ETAG = None
+_LAST_MODIFIED = None
+
 def get_price():
-    url = "https://polymarket.com/event/us-x-iran-nuclear-deal-in-2025"
+    global _ETAG, _LAST_MODIFIED
+    url = "https://gamma-api.polymarket.com/events?slug=us-x-iran-nuclear-deal-in-2025"
     try:
-        response = requests.get(url, timeout=10)
+        headers = {}
+        if _ETAG:
+            headers["If-None-Match"] = _ETAG
+        if _LAST_MODIFIED:
+            headers["If-Modified-Since"] = _LAST_MODIFIED
+        response = SESSION.get(url, timeout=10, headers=headers)
+        if response.status_code == 304:
+            # Unchanged upstream, reuse the last known price
+            with PRICE_LOCK:
+                return LAST_PRICE
         response.raise_for_status()
-        match = re.search(r'"outcomePrices":\s*\[\s*"([^"]+)"', response.text)
-        if match:
-            return round(float(match.group(1)) * 100, 2)
+        _ETAG = response.headers.get("ETag")
+        _LAST_MODIFIED = response.headers.get("Last-Modified")
+        events = orjson.loads(response.content)
+        # outcomePrices is itself a JSON-encoded list of price strings
+        prices = orjson.loads(events[0]["markets"][0]["outcomePrices"])
+        return round(float(prices[0]) * 100, 2)
     except Exception as e:
         print(f"Error fetching price: {e}")
     return None
@@ -37,8 +136,8 @@ def get_price():
 # --- Data storage ---
 def load_data():
     try:
-        with open(DATA_FILE, "r") as f:
-            return json.load(f)
+        with open(DATA_FILE, "rb") as f:
+            return orjson.loads(f.read())
     except FileNotFoundError:
         return []
     except Exception as e:
@@ -47,8 +146,8 @@ def load_data():
 
 def save_data(data):
     try:
-        with open(DATA_FILE, "w") as f:
-            json.dump(data, f)
+        with open(DATA_FILE, "wb") as f:
+            f.write(orjson.dumps(data))
     except Exception as e:
         print(f"Error saving data: {e}")
 
@@ -56,45 +155,111 @@ def fetch_and_store_price():
     try:
         price = get_price()
         if price is not None:
-            data = load_data()
+            set_cached_price(price)
             timestamp = int(time.time())
-            data.append({"time": timestamp, "price": price})
-            # Keep last 6 hours of data
-            cutoff = timestamp - 6 * 60 * 60
-            data = [d for d in data if d["time"] >= cutoff]
-            save_data(data)
+            SERIES.append({"time": timestamp, "price": price})
             print(f"Saved price {price} at {datetime.fromtimestamp(timestamp)}")
-        else:
-            print("Failed to fetch price")
+            return True
+        print("Failed to fetch price")
     except Exception as e:
         print(f"Error in fetch_and_store_price: {e}")
-    
-    # Schedule next fetch
-    threading.Timer(FETCH_INTERVAL, fetch_and_store_price).start()
+    return False
+
+async def fetch_job(context: ContextTypes.DEFAULT_TYPE):
+    """Repeating job: fetch the price and snapshot the series off the loop."""
+    changed = await asyncio.to_thread(fetch_and_store_price)
+    if changed:
+        await asyncio.to_thread(save_data, list(SERIES))
 
 # --- Plot price graph ---
+IMG_W, IMG_H = 800, 400
+MARGIN_L, MARGIN_R, MARGIN_T, MARGIN_B = 60, 20, 40, 40
+CURVE_COLOR = (0, 120, 200)
+
+def plot_prices_pil(data):
+    """Draw the price chart directly with Pillow (no matplotlib pipeline)."""
+    img = Image.new("RGB", (IMG_W, IMG_H), "white")
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default()
+
+    times = [d["time"] for d in data]
+    prices = [d["price"] for d in data]
+    t_min, t_max = times[0], times[-1]
+    p_min, p_max = min(prices), max(prices)
+    t_span = (t_max - t_min) or 1
+    p_span = (p_max - p_min) or 1
+
+    def px(t):
+        return MARGIN_L + (t - t_min) * (IMG_W - MARGIN_L - MARGIN_R) / t_span
+
+    def py(p):
+        return IMG_H - MARGIN_B - (p - p_min) * (IMG_H - MARGIN_T - MARGIN_B) / p_span
+
+    draw.text((IMG_W // 2 - 110, 10), "Polymarket Price - Last 6 Hours", fill="black", font=font)
+    draw.line([(MARGIN_L, MARGIN_T), (MARGIN_L, IMG_H - MARGIN_B),
+               (IMG_W - MARGIN_R, IMG_H - MARGIN_B)], fill="black")
+
+    for p in (p_min, (p_min + p_max) / 2, p_max):
+        y = py(p)
+        draw.line([(MARGIN_L - 4, y), (MARGIN_L, y)], fill="black")
+        draw.text((8, y - 6), f"{p:.1f}", fill="black", font=font)
+
+    for t in (t_min, (t_min + t_max) // 2, t_max):
+        x = px(t)
+        draw.line([(x, IMG_H - MARGIN_B), (x, IMG_H - MARGIN_B + 4)], fill="black")
+        label = datetime.fromtimestamp(t).strftime("%H:%M")
+        draw.text((x - 15, IMG_H - MARGIN_B + 8), label, fill="black", font=font)
+
+    points = [(px(t), py(p)) for t, p in zip(times, prices)]
+    if len(points) > 1:
+        draw.line(points, fill=CURVE_COLOR, width=2)
+    for x, y in points:
+        draw.ellipse([x - 3, y - 3, x + 3, y + 3], fill=CURVE_COLOR)
+
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", optimize=False, compress_level=1)
+    buf.seek(0)
+    return buf
+
+def plot_prices_mpl(data):
+    import numpy as np
+
+    # ndarrays feed matplotlib much faster than lists of Python datetimes,
+    # and datetime64 skips a fromtimestamp call (and object) per point
+    ts = np.fromiter((d["time"] for d in data), dtype=np.int64, count=len(data))
+    prices = np.fromiter((d["price"] for d in data), dtype=np.float32, count=len(data))
+    times = ts.astype("datetime64[s]")
+
+    with PLOT_LOCK:
+        fig, ax, line = _init_mpl()
+        line.set_data(times, prices)
+        ax.relim()
+        ax.autoscale_view()
+
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png")
+    buf.seek(0)
+    return buf
+
+# Rendered PNG cache: (timestamp of last sample, png bytes). The series only
+# changes every FETCH_INTERVAL, so one render serves the whole window.
+_PNG_CACHE = None
+
 def plot_prices():
+    global _PNG_CACHE
     try:
-        data = load_data()
+        data = list(SERIES)
         if not data:
             return None
-
-        times = [datetime.fromtimestamp(d["time"]) for d in data]
-        prices = [d["price"] for d in data]
-
-        plt.figure(figsize=(8, 4))
-        plt.plot(times, prices, marker='o')
-        plt.title("Polymarket Price - Last 6 Hours")
-        plt.xlabel("Time")
-        plt.ylabel("Price × 100")
-        plt.grid(True)
-        plt.gcf().autofmt_xdate()
-        plt.tight_layout()
-
-        img_path = "price_plot.png"
-        plt.savefig(img_path)
-        plt.close()
-        return img_path
+        cache = _PNG_CACHE
+        if cache and cache[0] == data[-1]["time"]:
+            return io.BytesIO(cache[1])
+        if USE_MATPLOTLIB:
+            buf = plot_prices_mpl(data)
+        else:
+            buf = plot_prices_pil(data)
+        _PNG_CACHE = (data[-1]["time"], buf.getvalue())
+        return buf
     except Exception as e:
         print(f"Error generating plot: {e}")
         return None
@@ -102,7 +267,7 @@ def plot_prices():
 # --- Telegram command handlers ---
 async def price_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        price = get_price()
+        price = await get_cached_price()
         if price is not None:
             await update.message.reply_text(f"📈 Current price: {price}")
         else:
@@ -119,11 +284,9 @@ async def hello_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def graph_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        img_path = plot_prices()
-        if img_path:
-            with open(img_path, "rb") as f:
-                await update.message.reply_photo(photo=InputFile(f))
-            os.remove(img_path)
+        buf = await asyncio.to_thread(plot_prices)
+        if buf:
+            await update.message.reply_photo(photo=InputFile(buf, filename="price.png"))
         else:
             await update.message.reply_text("No graph data available yet.")
     except Exception as e:
@@ -144,7 +307,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         print(f"Error in help_command: {e}")
 
 async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await start
+    await start_command(update, context)
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
@@ -164,18 +327,16 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.answer()
 
         if query.data == "price":
-            price = get_price()
+            price = await get_cached_price()
             if price is not None:
                 await query.edit_message_text(text=f"📈 {price}")
             else:
                 await query.edit_message_text(text="Price not available.")
         elif query.data == "graph":
-            img_path = plot_prices()
-            if img_path:
-                with open(img_path, "rb") as f:
-                    await query.delete_message()
-                    await query.message.reply_photo(photo=InputFile(f))
-                os.remove(img_path)
+            buf = await asyncio.to_thread(plot_prices)
+            if buf:
+                await query.delete_message()
+                await query.message.reply_photo(photo=InputFile(buf, filename="price.png"))
             else:
                 await query.edit_message_text(text="No graph data available yet.")
         elif query.data == "hello":
@@ -184,39 +345,58 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         print(f"Error in button_callback: {e}")
 
 # --- Main entry point ---
-async def main():
+HANDLERS = [
+    CommandHandler("start", start_command),
+    CommandHandler("price", price_command),
+    CommandHandler("graph", graph_command),
+    CommandHandler("hello", hello_command),
+    CommandHandler("help", help_command),
+    CommandHandler("menu", menu_command),
+    CallbackQueryHandler(button_callback),
+]
+
+BOT_COMMANDS = [
+    BotCommand("start", "Show menu with buttons"),
+    BotCommand("price", "Get current price"),
+    BotCommand("graph", "Show 6h price graph"),
+    BotCommand("hello", "Say hello"),
+    BotCommand("help", "Show help message"),
+    BotCommand("menu", "Show quick action buttons"),
+]
+
+async def post_init(app):
+    await app.bot.set_my_commands(BOT_COMMANDS)
+    # Price fetching runs on the job queue alongside the event loop
+    app.job_queue.run_repeating(fetch_job, interval=FETCH_INTERVAL, first=0)
+
+async def post_shutdown(app):
+    SESSION.close()
+
+def main():
     try:
-        # Ensure data file exists
-        if not os.path.exists(DATA_FILE):
-            with open(DATA_FILE, 'w') as f:
-                json.dump([], f)
-
-        app = Application.builder().token(BOT_TOKEN).build()
-
-        app.add_handler(CommandHandler("start", start_command))
-        app.add_handler(CommandHandler("price", price_command))
-        app.add_handler(CommandHandler("graph", graph_command))
-        app.add_handler(CommandHandler("hello", hello_command))
-        app.add_handler(CommandHandler("help", help_command))
-        app.add_handler(CommandHandler("menu", menu_command))
-        app.add_handler(CallbackQueryHandler(button_callback))
-
-        await app.bot.set_my_commands([
-            BotCommand("start", "Show menu with buttons"),
-            BotCommand("price", "Get current price"),
-            BotCommand("graph", "Show 6h price graph"),
-            BotCommand("hello", "Say hello"),
-            BotCommand("help", "Show help message"),
-            BotCommand("menu", "Show quick action buttons"),
-        ])
-
-        # Start price fetching in a separate thread
-        threading.Thread(target=fetch_and_store_price, daemon=True).start()
+        # Load the persisted series once; the poller keeps it fresh
+        SERIES.extend(load_data())
+
+        app = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .post_init(post_init)
+            .post_shutdown(post_shutdown)
+            .build()
+        )
+
+        app.add_handlers(HANDLERS)
+
         print("Bot is running. Send /start to try it.")
-        await app.run_polling()
+        # run_polling manages its own event loop (PTB v20)
+        app.run_polling()
     except Exception as e:
         print(f"Error in main: {e}")
 
 if __name__ == "__main__":
-    import asyncio
-    asyncio.run(main())
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass  # uvloop is Linux-only; fall back to the default loop
+    main()